@@ -6,10 +6,25 @@ I separated all the HTTP logic here so that the main script can focus
 on the data pipeline instead of low-level request details.
 """
 
+import asyncio
+import hashlib
+import json
 import logging
-from typing import Any, Dict
+import os
+import pickle
+import random
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
 
-import requests
+import httpx
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; the standard json module works, just slower
+    orjson = None
+
+T = TypeVar("T")
 
 # Base domain for the FSMA STORI *API* (this is different from the public website).
 BASE_URL: str = "https://webapi.fsma.be"
@@ -20,24 +35,144 @@ STORI_RESULT_ENDPOINT: str = "/api/v1/en/stori/result"
 # Endpoint used to download a specific document based on its fileDataId.
 STORI_DOWNLOAD_ENDPOINT: str = "/api/v1/en/stori/download"
 
+USER_AGENT: str = "STORI-Downloader/1.0 (academic project)"
+
+# Maximum number of requests in flight against the STORI API at once.
+# The backend starts answering with 429 when it gets too many in parallel.
+MAX_CONCURRENT_REQUESTS: int = 8
+SEM = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+# How often a throttled, failed (5xx) or dropped request is retried before giving up.
+MAX_RETRIES: int = 5
+
+# Status codes that are worth retrying instead of failing straight away.
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+# Parsed search responses are cached here, so re-runs don't repeat the same POSTs.
+CACHE_DIR: Path = Path(".cache")
+
+# How long (in seconds) a cached response is used before asking the API again.
+CACHE_TTL: int = 86400
+
+# Downloaded data is collected until there is at least this much (1 MiB)
+# and then written to disk with a single syscall.
+WRITE_BATCH_SIZE: int = 1024 * 1024
+
+# Flags for creating/overwriting a downloaded PDF (O_BINARY only exists on Windows)
+_WRITE_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0)
+
+# Gather writes need os.writev (not available on Windows), which takes at most
+# IOV_MAX buffers per call (1024 on Linux and macOS).
+_HAS_WRITEV = hasattr(os, "writev")
+_IOV_MAX = 1024
 
-def get_http_session() -> requests.Session:
+
+def json_loads(data: bytes) -> Any:
+    """
+    Parses JSON bytes (with orjson when it is installed).
+    """
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def json_dumps(data: Any) -> bytes:
+    """
+    Serializes data to JSON bytes with 2-space indentation
+    (with orjson when it is installed).
+    """
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2)
+    return json.dumps(data, indent=2).encode("utf-8")
+
+
+def get_http_session() -> httpx.AsyncClient:
     """
     Creates a reusable HTTP session.
 
-    I use a session instead of calling requests.get/post directly each time,
-    so that the underlying TCP connection can be reused and I can set headers
-    (like User-Agent) in one place.
+    I use a session instead of opening a new connection for every call,
+    so that the underlying connections can be reused and I can set headers
+    (like User-Agent) in one place. With HTTP/2 all concurrent requests are
+    multiplexed as streams over a single TLS connection to the STORI host,
+    so only the first request pays for the TCP + TLS handshake. If the server
+    only speaks HTTP/1.1, httpx falls back to a normal keep-alive pool.
+    Unlike requests and aiohttp, httpx doesn't follow redirects by default,
+    so that is switched on explicitly.
+    """
+    return httpx.AsyncClient(
+        http2=True,
+        follow_redirects=True,
+        limits=httpx.Limits(
+            max_connections=20,
+            max_keepalive_connections=20,
+            keepalive_expiry=60,
+        ),
+        timeout=60,
+        headers={
+            "User-Agent": USER_AGENT,
+            # Lets the server compress the (fairly large) JSON search results
+            "Accept-Encoding": "gzip, deflate",
+        },
+    )
+
+
+async def _request(
+    session: httpx.AsyncClient,
+    method: str,
+    url: str,
+    handle: Callable[[httpx.Response], Awaitable[T]],
+    **kwargs: Any,
+) -> T:
+    """
+    Sends a request while holding SEM and passes the response to `handle`.
+
+    A 429/5xx answer or a dropped connection is retried with exponential backoff
+    (plus some jitter, so parallel requests don't all retry at the same moment).
+    The semaphore is released while waiting, so other requests can continue.
+    304 Not Modified is passed on to `handle` like a success, since it is
+    the expected answer to a conditional request.
     """
-    session = requests.Session()
-    session.headers.update({
-        "User-Agent": "STORI-Downloader/1.0 (academic project)",
-    })
-    return session
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            async with SEM:
+                async with session.stream(method, url, **kwargs) as response:
+                    if response.status_code not in RETRY_STATUSES or attempt == MAX_RETRIES:
+                        if response.status_code != 304:
+                            response.raise_for_status()
+                        return await handle(response)
+                    reason = f"HTTP {response.status_code}"
+        except (httpx.NetworkError, httpx.RemoteProtocolError) as e:
+            if attempt == MAX_RETRIES:
+                raise
+            reason = str(e) or type(e).__name__
+
+        delay = min(2 ** attempt, 30) + random.random()
+        logging.warning(
+            "%s %s failed (%s), retrying in %.1fs (attempt %d/%d)",
+            method,
+            url,
+            reason,
+            delay,
+            attempt + 1,
+            MAX_RETRIES,
+        )
+        await asyncio.sleep(delay)
+
+    raise AssertionError("unreachable")
+
+
+async def _read_json(response: httpx.Response) -> Dict[str, Any]:
+    body = await response.aread()
+    try:
+        return json_loads(body)
+    except ValueError:
+        # If the server ever sends back HTML or some other format instead of JSON,
+        # this log helps me see what actually came back.
+        logging.error("Response from %s was not valid JSON. Raw text:", response.url)
+        logging.error(response.text[:500])
+        raise
 
 
-def post_json(
-    session: requests.Session,
+async def post_json(
+    session: httpx.AsyncClient,
     path: str,
     json_body: Dict[str, Any],
 ) -> Dict[str, Any]:
@@ -54,30 +189,65 @@ def post_json(
     logging.info("POST %s with JSON body: %s", url, json_body)
 
     try:
-        response = session.post(url, json=json_body, timeout=20)
-        response.raise_for_status()
-    except requests.exceptions.ReadTimeout:
+        data = await _request(
+            session,
+            "POST",
+            url,
+            _read_json,
+            json=json_body,
+            timeout=20,
+        )
+    except httpx.TimeoutException:
         logging.error("Request to %s timed out.", url)
         raise
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         logging.error("HTTP error while calling %s: %s", url, e)
         raise
 
+    logging.info("Successfully received JSON response from %s", url)
+    return data
+
+
+async def cached_post_json(
+    session: httpx.AsyncClient,
+    path: str,
+    json_body: Dict[str, Any],
+    ttl: int = CACHE_TTL,
+) -> Dict[str, Any]:
+    """
+    Same as post_json, but keeps the parsed response in a local pickle file.
+
+    The search payloads are deterministic and the results change slowly,
+    so a re-run within `ttl` seconds loads the already-parsed dict from disk
+    instead of repeating the request and the JSON decoding.
+    """
+    key = hashlib.sha256(
+        json.dumps([path, json_body], sort_keys=True).encode("utf-8")
+    ).hexdigest()
+    cache_file = CACHE_DIR / f"{key}.pkl"
+
     try:
-        data = response.json()
-    except Exception:
-        # If the server ever sends back HTML or some other format instead of JSON,
-        # this log helps me see what actually came back.
-        logging.error("Response from %s was not valid JSON. Raw text:", url)
-        logging.error(response.text[:500])
-        raise
+        if time.time() - cache_file.stat().st_mtime < ttl:
+            with cache_file.open("rb") as f:
+                data = pickle.load(f)
+            logging.info("Using cached response for %s from %s", path, cache_file)
+            return data
+    except FileNotFoundError:
+        pass
+    except (OSError, EOFError, pickle.UnpicklingError) as e:
+        logging.warning("Ignoring unreadable cache file %s: %s", cache_file, e)
+
+    data = await post_json(session, path, json_body)
+
+    CACHE_DIR.mkdir(exist_ok=True)
+    with cache_file.open("wb") as f:
+        pickle.dump(data, f)
 
-    logging.info("Successfully received JSON response from %s", url)
     return data
 
 
-def fetch_stori_results(
-    session: requests.Session,
+async def fetch_stori_results(
+    session: httpx.AsyncClient,
     search_payload: Dict[str, Any],
 ) -> Dict[str, Any]:
     """
@@ -90,38 +260,202 @@ def fetch_stori_results(
       - resultCount
       - storiResultItems (list of filings)
     """
-    return post_json(session, STORI_RESULT_ENDPOINT, search_payload)
+    return await cached_post_json(session, STORI_RESULT_ENDPOINT, search_payload)
+
+
+async def _in_thread(
+    func: Callable[..., T],
+    *args: Any,
+    undo: Optional[Callable[[T], Any]] = None,
+) -> T:
+    """
+    Like asyncio.to_thread, but doesn't return before the thread is done,
+    not even when the caller is cancelled.
+
+    A worker thread can't be interrupted. If cancellation came through while
+    it was still writing, the caller would close its fd, and the next open
+    could get the same fd number and receive the rest of those writes. So
+    the thread is waited for first and the CancelledError is raised after.
+    If the thread did succeed, `undo` gets its result (e.g. os.close for an
+    fd that nobody will receive anymore).
+    """
+    task = asyncio.ensure_future(asyncio.to_thread(func, *args))
+    try:
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        while not task.done():
+            try:
+                await asyncio.wait([task])
+            except asyncio.CancelledError:
+                pass
+        if undo is not None and not task.cancelled() and task.exception() is None:
+            undo(task.result())
+        raise
+
+
+def _open_output(path: Path, size: Optional[int]) -> int:
+    """
+    Opens (and truncates) the output file. When the final size is known, the
+    whole extent is reserved up front, so the filesystem allocates blocks once
+    instead of growing the file on every write. posix_fallocate doesn't exist
+    on Windows and some filesystems refuse it; both just skip that step.
+    """
+    fd = os.open(path, _WRITE_FLAGS, 0o644)
+    if size and hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(fd, 0, size)
+        except OSError:
+            pass
+    return fd
+
+
+def _write_all(fd: int, chunks: List[bytes]) -> None:
+    """
+    Writes a batch of chunks with one os.writev call (where it exists),
+    instead of one write() per chunk. Without writev the chunks are joined
+    and written with os.write. Both may write less than they were given,
+    so keep going until it's all out.
+    """
+    if not _HAS_WRITEV:
+        chunks = [b"".join(chunks)]
+
+    pending = [memoryview(chunk) for chunk in chunks]
+    while pending:
+        if _HAS_WRITEV:
+            written = os.writev(fd, pending[:_IOV_MAX])
+        else:
+            written = os.write(fd, pending[0])
+
+        # Drop the chunks that are fully written and trim a partly written one
+        done = 0
+        while done < len(pending) and written >= len(pending[done]):
+            written -= len(pending[done])
+            done += 1
+        pending = pending[done:]
+        if written:
+            pending[0] = pending[0][written:]
+
+
+async def _stream_to_file(
+    response: httpx.Response,
+    fd: int,
+    expected: Optional[int],
+) -> int:
+    """
+    Writes the response body to fd in batches and returns the final file size.
 
+    fd may have been preallocated to `expected` bytes, so a body that ends
+    early would otherwise look like a complete file with a zero-filled tail.
+    That case is raised as a protocol error, which _request retries.
+    """
+    written = 0
+    batch: List[bytes] = []
+    batch_size = 0
+    # Without a chunk_size, aiter_bytes hands over data as it arrives;
+    # the pieces are only written out once a full batch is together
+    async for chunk in response.aiter_bytes():
+        batch.append(chunk)
+        batch_size += len(chunk)
+        if batch_size >= WRITE_BATCH_SIZE:
+            await _in_thread(_write_all, fd, batch)
+            written += batch_size
+            batch = []
+            batch_size = 0
+    if batch:
+        await _in_thread(_write_all, fd, batch)
+        written += batch_size
+    if expected is not None and written < expected:
+        raise httpx.RemoteProtocolError(
+            f"Response body ended after {written} of {expected} bytes",
+            request=response.request,
+        )
+    return os.fstat(fd).st_size
 
-def download_file(
-    session: requests.Session,
+
+async def download_file(
+    session: httpx.AsyncClient,
     file_data_id: str,
-) -> bytes:
+    out_path: Path,
+    etag: Optional[str] = None,
+) -> Tuple[Optional[int], Optional[str]]:
     """
     Downloads a single file from STORI using its fileDataId.
 
     In the browser this is equivalent to:
         GET https://webapi.fsma.be/api/v1/en/stori/download?fileDataId=...
 
-    Here I return the raw bytes so the caller can decide how to save the file.
+    The response is streamed to disk in batches of about WRITE_BATCH_SIZE,
+    so memory use stays at one batch instead of the whole PDF, and writing
+    starts while the rest is still downloading. The data goes into a
+    temporary ".part" file that only replaces out_path once the whole body
+    has arrived, so a failed download never leaves a broken PDF behind.
+
+    If `etag` is given (the ETag of the copy already at out_path), the request
+    is sent with If-None-Match. When the server answers 304 Not Modified,
+    nothing is transferred and out_path is left as it is.
+
+    Returns (size, etag): the number of bytes saved, or None if the file was
+    not modified, and the ETag that belongs to the file now at out_path
+    (None if the server doesn't send one).
     """
     url = f"{BASE_URL}{STORI_DOWNLOAD_ENDPOINT}"
     params = {"fileDataId": file_data_id}
+    headers = {"If-None-Match": etag} if etag else None
+
+    logging.debug("Downloading fileDataId=%s from %s", file_data_id, url)
+
+    async def save_body(response: httpx.Response):
+        if response.status_code == 304:
+            return None, None, etag
 
-    logging.info("Downloading fileDataId=%s from %s", file_data_id, url)
+        # Opened only after the status check, so a retried attempt starts
+        # from an empty file.
+        # With Content-Encoding the length is the compressed size, not what
+        # ends up on disk, so only preallocate for plain responses.
+        content_length = response.headers.get("Content-Length")
+        expected = None
+        if content_length and not response.headers.get("Content-Encoding"):
+            expected = int(content_length)
+
+        part_path = out_path.with_suffix(".part")
+        try:
+            # Inside the try: a cancelled open still creates (and may
+            # preallocate) the file, which then has to go as well
+            fd = await _in_thread(_open_output, part_path, expected, undo=os.close)
+            try:
+                size = await _stream_to_file(response, fd, expected)
+            finally:
+                os.close(fd)
+            os.replace(part_path, out_path)
+        except BaseException:
+            # Also on cancellation: drop the incomplete file instead of leaving it
+            part_path.unlink(missing_ok=True)
+            raise
+        return size, response.headers.get("Content-Type"), response.headers.get("ETag")
 
     try:
-        response = session.get(url, params=params, timeout=60)
-        response.raise_for_status()
-    except requests.exceptions.RequestException as e:
+        size, content_type, new_etag = await _request(
+            session,
+            "GET",
+            url,
+            save_body,
+            params=params,
+            headers=headers,
+        )
+    except httpx.HTTPError as e:
         logging.error("Error downloading fileDataId=%s: %s", file_data_id, e)
         raise
 
-    logging.info(
-        "Downloaded %d bytes for fileDataId=%s (Content-Type: %s)",
-        len(response.content),
+    if size is None:
+        logging.debug("fileDataId=%s not modified, keeping %s", file_data_id, out_path)
+        return None, new_etag
+
+    logging.debug(
+        "Saved %d bytes for fileDataId=%s to %s (Content-Type: %s)",
+        size,
         file_data_id,
-        response.headers.get("Content-Type"),
+        out_path,
+        content_type,
     )
 
-    return response.content
+    return size, new_etag
@@ -12,14 +12,24 @@ The idea behind the project is:
 5. Stop after a maximum number of downloads (I use 5 here for testing so I don’t overload the server).
 """
 
-import json
+import asyncio
 import logging
-import re
+import logging.handlers
+import os
+import string
+from itertools import chain
 from pathlib import Path
-from typing import Any, List, Dict
+from typing import Any, List, Dict, NamedTuple, Optional, Set
+
+try:
+    import uvloop
+except ImportError:  # uvloop is optional (and not available on Windows)
+    uvloop = None
 
 from api_client import (
     get_http_session,
+    json_dumps,
+    json_loads,
     fetch_stori_results,
     download_file,
 )
@@ -28,6 +38,16 @@ from api_client import (
 # Logging + basic utilities
 # --------------------------------------------------------------------
 
+# Characters that are allowed to stay in a filename
+_FILENAME_CHARS = frozenset(string.ascii_letters + string.digits + "_-")
+
+# str.translate table that turns spaces into underscores and deletes every
+# other ASCII character (non-ASCII characters are dropped beforehand by
+# encoding to ASCII), so a name is cleaned in a single pass
+_FILENAME_TABLE = {c: None for c in range(128) if chr(c) not in _FILENAME_CHARS}
+_FILENAME_TABLE[ord(" ")] = "_"
+
+
 def setup_logging() -> None:
     """
     Creates both file and console log outputs.
@@ -37,12 +57,23 @@ def setup_logging() -> None:
     logs_dir = Path("logs")
     logs_dir.mkdir(exist_ok=True)
     log_file = logs_dir / "stori_downloader.log"
+    log_format = "%(asctime)s [%(levelname)s] %(message)s"
+
+    # The file is written in batches of up to 1024 records instead of once
+    # per record. Warnings/errors and the end of the run flush it right away.
+    file_handler = logging.FileHandler(log_file, encoding="utf-8", delay=True)
+    file_handler.setFormatter(logging.Formatter(log_format))
+    buffered_file_handler = logging.handlers.MemoryHandler(
+        capacity=1024,
+        flushLevel=logging.WARNING,
+        target=file_handler,
+    )
 
     logging.basicConfig(
         level=logging.INFO,
-        format="%(asctime)s [%(levelname)s] %(message)s",
+        format=log_format,
         handlers=[
-            logging.FileHandler(log_file, encoding="utf-8"),
+            buffered_file_handler,
             logging.StreamHandler(),
         ],
     )
@@ -59,8 +90,8 @@ def sanitize_for_filename(text: str) -> str:
     if not text:
         return "UNKNOWN"
 
-    text = text.strip().replace(" ", "_")
-    text = re.sub(r"[^A-Za-z0-9_\-]+", "", text)
+    text = text.strip().encode("ascii", "ignore").decode("ascii")
+    text = text.translate(_FILENAME_TABLE)
     return text or "UNKNOWN"
 
 
@@ -78,27 +109,41 @@ def build_output_filename(company_name: str, lei: str, publication_iso: str) ->
     return f"{company_part}_{lei_part}_AnnualReport_{date_part}.pdf"
 
 
+def read_json_file(path: Path) -> Any:
+    """
+    Reads a JSON file (with orjson when it is installed).
+    """
+    return json_loads(path.read_bytes())
+
+
+def write_json_file(path: Path, data: Any) -> None:
+    """
+    Writes a JSON file with 2-space indentation (with orjson when it is installed).
+    """
+    path.write_bytes(json_dumps(data))
+
+
 # --------------------------------------------------------------------
 # Issuer list handling (using local cached file to avoid API dependency)
 # --------------------------------------------------------------------
 
-def normalize_issuer_list(raw: Any) -> List[Dict[str, str]]:
+def normalize_issuer_list(raw: Any) -> Dict[str, List[str]]:
     """
     Takes raw issuer objects from the JSON file
     and transforms them into a simplified structure.
-    """
-    issuers: List[Dict[str, str]] = []
 
-    for issuer in raw:
-        issuers.append({
-            "id": issuer["companyId"],
-            "name": issuer.get("abbreviation") or "UNKNOWN",
-        })
+    The result is column-based: issuers["ids"][i] and issuers["names"][i]
+    belong to the same issuer. Two flat lists of strings take far less memory
+    than one small dict per issuer and are cheaper to loop over.
+    """
+    # List comprehensions skip the per-item append() method calls
+    ids = [issuer["companyId"] for issuer in raw]
+    names = [issuer.get("abbreviation") or "UNKNOWN" for issuer in raw]
 
-    return issuers
+    return {"ids": ids, "names": names}
 
 
-def ensure_issuer_file(session, path: Path) -> List[Dict[str, str]]:
+def ensure_issuer_file(session, path: Path) -> Dict[str, List[str]]:
     """
     Loads issuers from a local file.
     Since the dropdown endpoint was returning errors, I switched to
@@ -107,9 +152,9 @@ def ensure_issuer_file(session, path: Path) -> List[Dict[str, str]]:
     _ = session  # I kept the parameter for later expansion
 
     if path.exists():
-        raw = json.loads(path.read_text(encoding="utf-8"))
+        raw = read_json_file(path)
         issuers = normalize_issuer_list(raw)
-        logging.info("Loaded %d issuers from %s", len(issuers), path)
+        logging.info("Loaded %d issuers from %s", len(issuers["ids"]), path)
         return issuers
 
     # Fallback default, only used if the file isn't present
@@ -127,7 +172,7 @@ def ensure_issuer_file(session, path: Path) -> List[Dict[str, str]]:
         }
     ]
 
-    path.write_text(json.dumps(default_raw, indent=2), encoding="utf-8")
+    write_json_file(path, default_raw)
     return normalize_issuer_list(default_raw)
 
 
@@ -135,61 +180,146 @@ def ensure_issuer_file(session, path: Path) -> List[Dict[str, str]]:
 # Main download logic for an individual issuer
 # --------------------------------------------------------------------
 
-def download_for_issuer(
-    session,
-    company_id: str,
-    document_type_id: str,
-    publication_start: str,
-    max_downloads: int,
-    already_downloaded: int,
-) -> int:
+# Remembers, per fileDataId, which file it was saved to and its ETag, so that
+# re-runs can ask the server whether a document changed instead of
+# downloading it again. Lives inside the downloads folder.
+MANIFEST_NAME = "manifest.json"
+
+
+def load_manifest(path: Path) -> Dict[str, Dict[str, str]]:
     """
-    Searches for report filings and then downloads PDF files.
+    Loads the download manifest, or starts an empty one on the first run.
     """
-    if already_downloaded >= max_downloads:
-        return already_downloaded
+    if not path.exists():
+        return {}
+    return read_json_file(path)
 
-    # The payload structure comes directly from observing browser traffic
-    search_payload = {
-        "startRowIndex": 0,
-        "pageSize": 50,
-        "sortDirection": "Ascending",
-        "documentTypeId": document_type_id,
-        "isDocumentTypeGroup": False,
-        "publicationStart": publication_start,
-        "companyId": company_id,
-    }
 
-    logging.info("Searching STORI for companyId=%s", company_id)
-    results = fetch_stori_results(session, search_payload)
-    items = results.get("storiResultItems") or []
+def save_manifest(path: Path, manifest: Dict[str, Dict[str, str]]) -> None:
+    """
+    Saves the download manifest. It is written to a temporary file first,
+    so an interrupted run never leaves a half-written manifest behind.
+    """
+    tmp_path = path.with_name(path.name + ".tmp")
+    write_json_file(tmp_path, manifest)
+    os.replace(tmp_path, path)
 
-    logging.info(
-        "Issuer %s: resultCount=%s, items=%s",
-        company_id,
-        results.get("resultCount"),
-        len(items),
-    )
 
-    downloads_dir = Path("downloads")
-    downloads_dir.mkdir(exist_ok=True)
+# Document languages worth downloading (English and Dutch)
+_LANGUAGES = frozenset({"en", "nl"})
+
+# File extensions that count as a PDF when the fileType field doesn't say so
+# (all four characters long, so a name's last four characters can be looked up)
+_PDF_EXTENSIONS = frozenset({".pdf"})
+
+
+# How many issuers are searched/downloaded at the same time
+# (the number of HTTP requests in flight is still capped by api_client.SEM)
+MAX_CONCURRENT_ISSUERS = 10
+
+
+class DownloadBudget:
+    """
+    How many PDFs may still be downloaded in this run.
+
+    Issuers are processed concurrently, so they all draw from one shared
+    budget. Checking `remaining` and calling `take` happen without an await
+    in between, so on the single event loop thread no other issuer can sneak
+    in between the two.
+
+    A reservation only becomes final when its downloads are done: files the
+    server reports as not modified are handed back by `settle`. Until then
+    an empty budget may still refill, so `wait_for_room` waits for the
+    outstanding reservations instead of giving up straight away.
+    """
+
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self.used = 0
+        # Reserved by downloads that haven't finished yet
+        self.pending = 0
+        self._settled = asyncio.Condition()
+
+    @property
+    def remaining(self) -> int:
+        return self.limit - self.used
+
+    def take(self, count: int) -> None:
+        self.used += count
+        self.pending += count
+
+    async def settle(self, reserved: int, downloaded: int) -> None:
+        """
+        Ends a reservation of `reserved` downloads, of which `downloaded`
+        were actually transferred; the rest goes back to the budget.
+        """
+        self.used -= reserved - downloaded
+        self.pending -= reserved
+        async with self._settled:
+            self._settled.notify_all()
+
+    async def wait_for_room(self) -> bool:
+        """
+        Returns True as soon as something is left in the budget, or False once
+        it is used up and no reservation can hand anything back anymore.
+        """
+        async with self._settled:
+            await self._settled.wait_for(
+                lambda: self.remaining > 0 or self.pending == 0
+            )
+        return self.remaining > 0
+
+
+class DownloadPlan(NamedTuple):
+    """
+    One document that was selected for download and the path it will be saved to.
+    """
+    file_data_id: str
+    output_path: Path
+    # ETag of the copy already at output_path (from an earlier run), if any
+    etag: Optional[str] = None
 
-    download_count = already_downloaded
-    MAX = max_downloads
+
+def plan_downloads(
+    items: List[Dict[str, Any]],
+    max_downloads: int,
+    downloads_dir: Path,
+    on_disk_names: Set[str],
+    claimed_names: Set[str],
+    planned_ids: Set[str],
+    manifest: Dict[str, Dict[str, str]],
+) -> List[DownloadPlan]:
+    """
+    Picks the documents to download from the search result items.
+
+    This step does no I/O at all: it only filters the documents and chooses
+    an output filename for each one, so that all downloads can be started
+    together afterwards. At most max_downloads documents are returned.
+
+    on_disk_names is the listing of downloads_dir from the start of the run.
+    claimed_names holds every filename handed out during this run and is
+    updated as names are picked; a name in either set is taken.
+    planned_ids works the same way for fileDataIds, so calling this again
+    with the same items only picks documents that weren't planned yet.
+    A document that the manifest says was saved before keeps its old file
+    and ETag, so it can be downloaded conditionally, as long as that file
+    was on disk at the start and no other document has claimed it since.
+    """
+    plans: List[DownloadPlan] = []
 
     # Loop through filings and pick documents that qualify
     for item in items:
-        if download_count >= MAX:
+        if len(plans) >= max_downloads:
             break
 
         company_name = item.get("companyName") or "UNKNOWN_COMPANY"
         lei = item.get("lei") or "NO_LEI"
         publication_iso = item.get("datePublication") or "UNKNOWN_DATE"
 
-        documents = (item.get("mainDocuments") or []) + (item.get("attachments") or [])
+        documents = chain(item.get("mainDocuments") or (), item.get("attachments") or ())
 
         for doc in documents:
-            if download_count >= MAX:
+            if len(plans) >= max_downloads:
                 break
 
             file_type = (doc.get("fileType") or "").lower()
@@ -197,84 +327,238 @@ def download_for_issuer(
             original_name = (doc.get("originalFileName") or "").lower()
 
             # Filter only EN/NL PDF files
-            if language not in ("en", "nl"):
+            if language not in _LANGUAGES:
                 continue
-            if file_type != "pdf" and not original_name.endswith(".pdf"):
+            if file_type != "pdf" and original_name[-4:] not in _PDF_EXTENSIONS:
                 continue
 
             file_data_id = doc.get("fileDataId")
-            if not file_data_id:
+            if not file_data_id or file_data_id in planned_ids:
+                continue
+            planned_ids.add(file_data_id)
+
+            # Saved by an earlier run and still on disk: re-check it in place
+            previous = manifest.get(file_data_id) or {}
+            previous_name = previous.get("file")
+            if (
+                previous.get("etag")
+                and previous_name in on_disk_names
+                and previous_name not in claimed_names
+            ):
+                claimed_names.add(previous_name)
+                output_path = downloads_dir / previous_name
+                logging.debug("Re-checking %s (fileDataId=%s)", output_path, file_data_id)
+                plans.append(DownloadPlan(file_data_id, output_path, previous["etag"]))
                 continue
 
             output_name = build_output_filename(company_name, lei, publication_iso)
-            output_path = downloads_dir / output_name
 
             # If filename already exists, add version numbers
-            if output_path.exists():
+            if output_name in on_disk_names or output_name in claimed_names:
                 stem, dot, ext = output_name.rpartition(".")
                 counter = 2
-                while output_path.exists():
-                    output_path = downloads_dir / f"{stem}_v{counter}.{ext}"
+                while output_name in on_disk_names or output_name in claimed_names:
+                    output_name = f"{stem}_v{counter}.{ext}"
                     counter += 1
 
-            logging.info(
-                "Downloading %s (LEI=%s) → %s",
+            claimed_names.add(output_name)
+            output_path = downloads_dir / output_name
+
+            logging.debug(
+                "Queued %s (LEI=%s) → %s",
                 company_name,
                 lei,
                 output_path,
             )
 
-            file_bytes = download_file(session, file_data_id)
-            output_path.write_bytes(file_bytes)
+            plans.append(DownloadPlan(file_data_id, output_path))
+
+    return plans
+
+
+async def execute_downloads(
+    session,
+    plans: List[DownloadPlan],
+    manifest: Dict[str, Dict[str, str]],
+) -> int:
+    """
+    Starts all planned downloads at once and waits for them to finish.
+    (The number actually in flight is still capped by api_client.SEM.)
+
+    Each download that came with an ETag is recorded in the manifest as
+    soon as it completes, and all of them are waited for before an error is
+    raised, so the ones that did finish are never lost. Returns how many
+    files were actually transferred; files the server reported as not
+    modified don't count.
+    """
+    async def run(plan: DownloadPlan) -> bool:
+        size, etag = await download_file(
+            session, plan.file_data_id, plan.output_path, plan.etag
+        )
+        if etag:
+            manifest[plan.file_data_id] = {"file": plan.output_path.name, "etag": etag}
+        else:
+            # Without an ETag there is nothing to re-check on the next run
+            manifest.pop(plan.file_data_id, None)
+        return size is not None
+
+    results = await asyncio.gather(
+        *[run(plan) for plan in plans],
+        return_exceptions=True,
+    )
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+
+    return sum(results)
+
+
+async def download_for_issuer(
+    session,
+    company_id: str,
+    document_type_id: str,
+    publication_start: str,
+    budget: DownloadBudget,
+    downloads_dir: Path,
+    on_disk_names: Set[str],
+    claimed_names: Set[str],
+    manifest: Dict[str, Dict[str, str]],
+) -> int:
+    """
+    Searches for report filings and then downloads PDF files.
+
+    The work is split in two phases: first all qualifying documents are
+    selected (plan_downloads), then they are downloaded together
+    (execute_downloads). When the budget runs out before every document is
+    planned, this waits for other issuers' reservations to settle and plans
+    the rest with whatever they hand back. Returns how many PDFs were
+    actually transferred for this issuer.
+    """
+    if not await budget.wait_for_room():
+        return 0
+
+    # The payload structure comes directly from observing browser traffic
+    search_payload = {
+        "startRowIndex": 0,
+        "pageSize": 50,
+        "sortDirection": "Ascending",
+        "documentTypeId": document_type_id,
+        "isDocumentTypeGroup": False,
+        "publicationStart": publication_start,
+        "companyId": company_id,
+    }
+
+    logging.info("Searching STORI for companyId=%s", company_id)
+    results = await fetch_stori_results(session, search_payload)
+    items = results.get("storiResultItems") or []
+
+    logging.info(
+        "Issuer %s: resultCount=%s, items=%s",
+        company_id,
+        results.get("resultCount"),
+        len(items),
+    )
 
-            logging.info("Saved %d bytes to %s", len(file_bytes), output_path)
+    downloaded = 0
+    planned_ids: Set[str] = set()
+    while await budget.wait_for_room():
+        plans = plan_downloads(
+            items,
+            budget.remaining,
+            downloads_dir,
+            on_disk_names,
+            claimed_names,
+            planned_ids,
+            manifest,
+        )
+        if not plans:
+            break
+        budget.take(len(plans))
 
-            download_count += 1
+        transferred = 0
+        try:
+            transferred = await execute_downloads(session, plans, manifest)
+        finally:
+            save_manifest(downloads_dir / MANIFEST_NAME, manifest)
+            # Unchanged files were not transferred, so they don't use up the budget
+            await budget.settle(len(plans), transferred)
+        downloaded += transferred
 
-    return download_count
+    return downloaded
 
 
 # --------------------------------------------------------------------
 # Main runner
 # --------------------------------------------------------------------
 
-def main() -> None:
+async def main() -> None:
     """
     Coordinates the full download pipeline.
     """
     setup_logging()
     logging.info("Starting STORI Annual Report Downloader.")
 
-    session = get_http_session()
-
     DOCUMENT_TYPE_ANNUAL = "9813c451-9fd4-41ba-ba7d-4e0dda0d3051"
     MAX_DOWNLOADS = 5
-    total_downloads = 0
+    budget = DownloadBudget(MAX_DOWNLOADS)
 
     issuers_file = Path("issuers.json.txt")
-    issuers = ensure_issuer_file(session, issuers_file)
 
-    if not issuers:
-        logging.warning("No issuers found, stopping early.")
-        return
-
-    for issuer in issuers:
-        if total_downloads >= MAX_DOWNLOADS:
-            break
-
-        logging.info("Processing issuer %s (%s)", issuer["name"], issuer["id"])
-
-        total_downloads = download_for_issuer(
-            session=session,
-            company_id=issuer["id"],
-            document_type_id=DOCUMENT_TYPE_ANNUAL,
-            publication_start="2011-01-01",
-            max_downloads=MAX_DOWNLOADS,
-            already_downloaded=total_downloads,
-        )
+    downloads_dir = Path("downloads")
+    downloads_dir.mkdir(exist_ok=True)
+    # One directory listing up front instead of an exists() check per file
+    on_disk_names = set(os.listdir(downloads_dir))
+    # Filenames handed out during this run (they may not exist on disk yet)
+    claimed_names: Set[str] = set()
+    manifest = load_manifest(downloads_dir / MANIFEST_NAME)
+
+    async with get_http_session() as session:
+        issuers = ensure_issuer_file(session, issuers_file)
+
+        if not issuers["ids"]:
+            logging.warning("No issuers found, stopping early.")
+            return
+
+        # Issuers are independent, so several are searched at once instead of
+        # waiting for each search (and its downloads) before starting the next
+        issuer_sem = asyncio.Semaphore(MAX_CONCURRENT_ISSUERS)
+
+        async def process_issuer(company_id: str, company_name: str) -> int:
+            async with issuer_sem:
+                if not await budget.wait_for_room():
+                    return 0
+
+                logging.info("Processing issuer %s (%s)", company_name, company_id)
+
+                return await download_for_issuer(
+                    session=session,
+                    company_id=company_id,
+                    document_type_id=DOCUMENT_TYPE_ANNUAL,
+                    publication_start="2011-01-01",
+                    budget=budget,
+                    downloads_dir=downloads_dir,
+                    on_disk_names=on_disk_names,
+                    claimed_names=claimed_names,
+                    manifest=manifest,
+                )
+
+        counts = await asyncio.gather(*[
+            process_issuer(company_id, company_name)
+            for company_id, company_name in zip(issuers["ids"], issuers["names"])
+        ])
+        total_downloads = sum(counts)
 
     logging.info("Finished. Total PDFs downloaded: %d", total_downloads)
 
 
 if __name__ == "__main__":
-    main()
+    # uvloop is a drop-in replacement for the default event loop with less
+    # overhead per task and per socket operation
+    if uvloop is None:
+        asyncio.run(main())
+    elif hasattr(uvloop, "run"):
+        uvloop.run(main())
+    else:
+        # uvloop.run only exists since 0.18; older versions install a policy
+        uvloop.install()
+        asyncio.run(main())